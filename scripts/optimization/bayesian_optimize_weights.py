@@ -1,31 +1,39 @@
 """
 Bayesian Optimization for Hybrid Weight Evolution Parameters.
 
-Uses Gaussian Process with Expected Improvement to find optimal
-phase boundaries and weight targets.
+Uses Expected Improvement over a gradient-boosted tree (GBRT) surrogate
+to find optimal phase boundaries and weight targets, switching to a
+Gaussian Process for the final refinement iterations. Configurations are
+evaluated asynchronously in parallel worker processes: as soon as one
+finishes, its result is told to the optimizer and a replacement is
+proposed with still-running points imputed by a constant liar.
 
 Usage:
-    python bayesian_optimize_weights.py [--n-iter 150] [--n-initial 25]
+    python bayesian_optimize_weights.py [--n-iter 150] [--n-initial 25] [--n-workers 4]
+                                        [--surrogate GBRT] [--gp-refine 20]
+                                        [--warm-start results/optimization_TIMESTAMP.jsonl]
 """
 
 import argparse
-import json
+import copy
+import os
 import time
 import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 import numpy as np
-import matplotlib.pyplot as plt
+import orjson
 from skopt import Optimizer
+from skopt.learning.gaussian_process.kernels import WhiteKernel
 
 # Fix Windows console encoding issues
 if sys.platform == 'win32':
     sys.stdout.reconfigure(encoding='utf-8')
     sys.stderr.reconfigure(encoding='utf-8')
 from skopt.space import Real, Integer
-from skopt.plots import plot_convergence, plot_objective
 
 from evaluate_config import evaluate_config
 
@@ -34,14 +42,21 @@ from evaluate_config import evaluate_config
 # CONFIGURATION
 # ============================================================================
 
-# Parameter space
+# Parameter space (reparameterized so every point satisfies the constraints,
+# see decode_params): phase2_end = phase1_end + phase2_gap, and g0..g3 are
+# softmax-normalized into the weight increments between initial_weight,
+# phase1_target, phase2_target and max_weight. The gap range keeps the old
+# phase2_end range (15-30) reachable from every phase1_end, and logits in
+# [-3, 3] let any single share span ~0.2%-99% of the weight range
 PARAM_SPACE = [
     Real(0.40, 0.60, name='initial_weight'),
     Integer(5, 15, name='phase1_end'),
-    Integer(15, 30, name='phase2_end'),
-    Real(0.55, 0.75, name='phase1_target'),
-    Real(0.75, 0.95, name='phase2_target'),
+    Integer(4, 25, name='phase2_gap'),
     Real(0.85, 0.98, name='max_weight'),
+    Real(-3.0, 3.0, name='g0'),
+    Real(-3.0, 3.0, name='g1'),
+    Real(-3.0, 3.0, name='g2'),
+    Real(-3.0, 3.0, name='g3'),
 ]
 
 # Objective function weights
@@ -50,8 +65,40 @@ RMSE_WEIGHT = 0.3
 RMSE_TARGET = 0.70
 RMSE_PENALTY_THRESHOLD = 0.75
 
+RESULTS_DIR = Path(__file__).parent / 'results'
+
 # Early stopping
-EARLY_STOP_PATIENCE = 25  # Stop if no improvement for this many iterations
+EARLY_STOP_PATIENCE = 25  # Stop if no full-fidelity improvement for this many iterations
+
+# Surrogate model: trees fit in O(N log N) versus O(N^3) for a GP, so the
+# bulk of the run uses GBRT and only the last GP_REFINE_ITER iterations
+# switch to a GP for refinement
+SURROGATES = ['GP', 'GBRT', 'RF', 'ET']
+DEFAULT_SURROGATE = 'GBRT'
+GP_REFINE_ITER = 20
+ACQ_N_POINTS = 5000  # Candidates scored per acquisition (skopt default: 10000)
+
+# GP surrogate refit: kernel hyperparameters are re-optimized (L-BFGS with
+# a few restarts) only every GP_REFIT_EVERY tells; in between the last
+# fitted kernel is reused and a refit is a single Cholesky factorization
+GP_RESTARTS = 2
+GP_REFIT_EVERY = 5
+
+# Multi-fidelity: early iterations only need a rough ranking of configs,
+# so they simulate fewer students (full fidelity matches the 'testing'
+# Monte Carlo config)
+LOW_FIDELITY_STUDENTS = 25  # Random initialization
+MID_FIDELITY_STUDENTS = 50  # First n_initial model-guided iterations
+FULL_FIDELITY_STUDENTS = 100
+
+# Result cache: configs that round to the same key (Real dims to this many
+# decimals, Integer dims exact, same fidelity) reuse the earlier result
+# instead of rerunning the simulation
+CACHE_DECIMALS = 3
+
+# Parallel evaluation: each worker runs its own Node.js simulation,
+# so stay well below the core count to leave headroom for memory
+DEFAULT_N_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
 
 # ============================================================================
 # OBJECTIVE FUNCTION
@@ -85,64 +132,93 @@ def calculate_objective(correlation: float, rmse: float) -> float:
     return objective
 
 
-def validate_config(params: List[float]) -> bool:
+def decode_params(params: List[float]) -> dict:
+    """
+    Map an optimizer point to a hybrid weight configuration.
+
+    Args:
+        params: [initial_weight, phase1_end, phase2_gap, max_weight,
+                 g0, g1, g2, g3]
+
+    Returns:
+        dict with keys: initial_weight, phase1_end, phase2_end,
+        phase1_target, phase2_target, max_weight
+    """
+    initial_weight, phase1_end, phase2_gap, max_weight, *gaps = params
+
+    # Softmax shares of the initial -> max span, all strictly positive
+    shares = np.exp(gaps)
+    increments = shares / shares.sum() * (max_weight - initial_weight)
+
+    phase1_target = initial_weight + increments[0]
+    phase2_target = phase1_target + increments[1] + increments[2]
+
+    return {
+        'initial_weight': float(initial_weight),
+        'phase1_end': int(phase1_end),
+        'phase2_end': int(phase1_end + phase2_gap),
+        'phase1_target': float(phase1_target),
+        'phase2_target': float(phase2_target),
+        'max_weight': float(max_weight)
+    }
+
+
+def params_to_list(params: List[float]) -> list:
+    """Convert an optimizer point to plain Python numbers (JSON-safe)."""
+    return [int(v) if isinstance(dim, Integer) else float(v)
+            for dim, v in zip(PARAM_SPACE, params)]
+
+
+def cache_key(params: List[float], n_students: int) -> tuple:
+    """Result cache key: params rounded to the grid resolution plus fidelity."""
+    return tuple(v if isinstance(v, int) else round(v, CACHE_DECIMALS)
+                 for v in params_to_list(params)) + (n_students,)
+
+
+def validate_config(config: dict) -> bool:
     """
     Check if configuration is valid (satisfies constraints).
 
     Args:
-        params: [initial_weight, phase1_end, phase2_end, phase1_target,
-                 phase2_target, max_weight]
+        config: Decoded configuration (see decode_params)
 
     Returns:
         True if valid, False otherwise
     """
-    initial_weight, phase1_end, phase2_end, phase1_target, phase2_target, max_weight = params
-
-    # Constraint 1: Phases must be distinct
-    if phase2_end <= phase1_end + 3:
-        return False
+    return (
+        # Constraint 1: Phases must be distinct
+        config['phase2_end'] - config['phase1_end'] > 3
+        # Constraint 2: Weights must be monotonically increasing
+        and (config['initial_weight'] < config['phase1_target']
+             < config['phase2_target'] < config['max_weight'])
+    )
 
-    # Constraint 2: Weights must be monotonically increasing
-    if not (initial_weight < phase1_target < phase2_target < max_weight):
-        return False
 
-    return True
+def students_for_iteration(i: int, n_initial: int) -> int:
+    """Number of simulated students for the i-th (0-based) evaluation."""
+    if i < n_initial:
+        return LOW_FIDELITY_STUDENTS
+    if i < 2 * n_initial:
+        return MID_FIDELITY_STUDENTS
+    return FULL_FIDELITY_STUDENTS
 
 
-def evaluate_with_objective(params: List[float]) -> float:
+def evaluate_with_objective(params: List[float],
+                            n_students: int = FULL_FIDELITY_STUDENTS) -> float:
     """
     Evaluate a configuration and return objective score.
 
     Args:
-        params: [initial_weight, phase1_end, phase2_end, phase1_target,
-                 phase2_target, max_weight]
+        params: Optimizer point (see PARAM_SPACE)
+        n_students: Simulated students (evaluation fidelity)
 
     Returns:
         Negative objective score (for minimization)
     """
-    # Unpack parameters
-    initial_weight, phase1_end, phase2_end, phase1_target, phase2_target, max_weight = params
-
-    # Check constraints
-    if not validate_config(params):
-        print(f"  ⚠️  Invalid config (constraints violated)")
-        return 999.0  # Return large value for minimization
+    config = decode_params(params)
 
-    # Run Monte Carlo simulation
-    print(f"  Evaluating config: initial={initial_weight:.2f}, "
-          f"p1={phase1_end}, p2={phase2_end}, "
-          f"t1={phase1_target:.2f}, t2={phase2_target:.2f}, max={max_weight:.2f}")
-
-    start_time = time.time()
-    results = evaluate_config(
-        initial_weight=initial_weight,
-        phase1_end=int(phase1_end),
-        phase2_end=int(phase2_end),
-        phase1_target=phase1_target,
-        phase2_target=phase2_target,
-        max_weight=max_weight
-    )
-    elapsed = time.time() - start_time
+    # Run Monte Carlo simulation (the parent logs the outcome)
+    results = evaluate_config(**config, n_students=n_students)
 
     if 'error' in results:
         print(f"  ❌ Evaluation failed: {results['error']}")
@@ -153,28 +229,155 @@ def evaluate_with_objective(params: List[float]) -> float:
 
     objective = calculate_objective(correlation, rmse)
 
-    print(f"  [+] Results: corr={correlation:.3f}, rmse={rmse:.3f}, "
-          f"obj={objective:.3f} (time={elapsed:.1f}s)")
-
     # Return negative objective for minimization
     return -objective
 
 
+def ask_with_liars(optimizer: Optimizer, pending: List[list]) -> list:
+    """
+    Suggest the next configuration while other evaluations are running.
+
+    Still-running points are told the mean objective of the successful
+    evaluations (constant liar) on a throwaway copy of the optimizer, so
+    the suggestion steers away from them without polluting the real
+    surrogate. Failed evaluations (999.0) are left out of the mean so one
+    timeout cannot drag the lie far outside the objective range; if every
+    evaluation so far failed, the pending points are told the worst
+    observation instead, so parallel suggestions still differ.
+
+    Args:
+        optimizer: Optimizer holding all completed evaluations
+        pending: Configurations currently being evaluated
+
+    Returns:
+        Next configuration to evaluate
+    """
+    if not pending or not optimizer.yi:
+        return optimizer.ask()
+
+    successes = [y for y in optimizer.yi if y != 999.0]
+    lie = float(np.mean(successes)) if successes else float(max(optimizer.yi))
+
+    opt = optimizer.copy(random_state=optimizer.rng.randint(0, np.iinfo(np.int32).max))
+    opt.tell(pending, [lie] * len(pending))
+    return opt.ask()
+
+
+class GPRefitSchedule:
+    """
+    Throttle GP kernel hyperparameter optimization across tells.
+
+    skopt refits a fresh GP on every tell. Between scheduled refits the
+    base estimator is given the last fitted kernel with its optimizer
+    disabled, so only the posterior is recomputed on the new data. On
+    scheduled refits L-BFGS is warm-started from that same kernel.
+    """
+
+    def __init__(self, optimizer: Optimizer, every: int = GP_REFIT_EVERY,
+                 n_restarts: int = GP_RESTARTS):
+        self.optimizer = optimizer
+        self.every = every
+        self.n_told = 0
+        optimizer.base_estimator_.set_params(n_restarts_optimizer=n_restarts)
+
+    def before_tell(self):
+        """Configure the base estimator for the upcoming tell."""
+        self.n_told += 1
+        if not self.optimizer.models:
+            return
+
+        # skopt zeroes the fitted noise level after fitting; restore it
+        last_model = self.optimizer.models[-1]
+        kernel = copy.deepcopy(last_model.kernel_)
+        kernel.set_params(k2=WhiteKernel(noise_level=last_model.noise_))
+
+        refit = self.n_told % self.every == 0
+        self.optimizer.base_estimator_.set_params(
+            kernel=kernel,
+            optimizer='fmin_l_bfgs_b' if refit else None
+        )
+
+
+def make_optimizer(surrogate: str, n_initial: int) -> Tuple[Optimizer, Optional[GPRefitSchedule]]:
+    """
+    Build an optimizer for the given surrogate model.
+
+    Args:
+        surrogate: One of SURROGATES
+        n_initial: Number of random initialization points
+
+    Returns:
+        (optimizer, GP refit schedule or None for tree surrogates)
+    """
+    try:
+        optimizer = Optimizer(
+            dimensions=PARAM_SPACE,
+            base_estimator=surrogate,
+            acq_func="EI",  # Expected Improvement
+            acq_optimizer="sampling",
+            acq_optimizer_kwargs={'n_points': ACQ_N_POINTS},
+            n_initial_points=n_initial,
+            random_state=42
+        )
+    except ValueError:
+        if surrogate == 'GP':
+            raise
+        # scikit-optimize 0.10's GBRT regressor is rejected by scikit-learn>=1.6
+        print(f"  [!] {surrogate} surrogate needs scikit-learn<1.6 with scikit-optimize 0.10; "
+              f"falling back to GP")
+        return make_optimizer('GP', n_initial)
+    gp_schedule = GPRefitSchedule(optimizer) if surrogate == 'GP' else None
+
+    return optimizer, gp_schedule
+
+
 # ============================================================================
 # OPTIMIZATION LOOP
 # ============================================================================
 
-def run_optimization(n_iter: int = 150, n_initial: int = 25) -> dict:
+def load_prior_results(path: Path) -> List[dict]:
+    """
+    Load result rows from a previous run.
+
+    Args:
+        path: Per-iteration JSONL checkpoint or final JSON snapshot
+
+    Returns:
+        List of result rows
+    """
+    with open(path, 'rb') as f:
+        if path.suffix == '.jsonl':
+            return [orjson.loads(line) for line in f if line.strip()]
+        return orjson.loads(f.read())['all_results']
+
+
+def run_optimization(n_iter: int = 150, n_initial: int = 25,
+                     n_workers: int = DEFAULT_N_WORKERS,
+                     surrogate: str = DEFAULT_SURROGATE,
+                     gp_refine: int = GP_REFINE_ITER,
+                     warm_start: List[dict] = None) -> dict:
     """
     Run Bayesian optimization to find best hyperparameters.
 
     Args:
         n_iter: Total number of iterations
         n_initial: Number of random initialization points
+        n_workers: Number of configurations evaluated in parallel
+        surrogate: Surrogate model for the main loop (one of SURROGATES)
+        gp_refine: Final iterations proposed with a GP surrogate instead
+        warm_start: Result rows from a previous run to seed the optimizer
 
     Returns:
         dict with optimization results
+
+    Every completed iteration is appended to
+    results/optimization_TIMESTAMP.jsonl as it finishes, so an interrupted
+    run loses at most the evaluations still in flight.
     """
+    RESULTS_DIR.mkdir(exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    checkpoint_file = RESULTS_DIR / f'optimization_{timestamp}.jsonl'
+
     print("=" * 80)
     print("BAYESIAN OPTIMIZATION FOR HYBRID WEIGHT EVOLUTION")
     print("=" * 80)
@@ -182,7 +385,12 @@ def run_optimization(n_iter: int = 150, n_initial: int = 25) -> dict:
     print(f"Configuration:")
     print(f"  Total iterations: {n_iter}")
     print(f"  Random initialization: {n_initial}")
+    print(f"  Parallel workers: {n_workers}")
+    print(f"  Surrogate: {surrogate}")
+    if surrogate != 'GP' and gp_refine > 0:
+        print(f"  GP refinement iterations: {gp_refine}")
     print(f"  Early stop patience: {EARLY_STOP_PATIENCE}")
+    print(f"  Checkpoint file: {checkpoint_file}")
     print()
     print(f"Parameter space:")
     for dim in PARAM_SPACE:
@@ -197,75 +405,165 @@ def run_optimization(n_iter: int = 150, n_initial: int = 25) -> dict:
     print()
 
     # Initialize optimizer
-    optimizer = Optimizer(
-        dimensions=PARAM_SPACE,
-        base_estimator="GP",  # Gaussian Process
-        acq_func="EI",  # Expected Improvement
-        acq_optimizer="sampling",
-        n_initial_points=n_initial,
-        random_state=42
-    )
+    optimizer, gp_schedule = make_optimizer(surrogate, n_initial)
+
+    # Warm start: every told point also counts toward n_initial, so the
+    # random initialization shrinks by the number of prior evaluations
+    n_prior = 0
+    prior = []
+    result_cache = {}
+    if warm_start:
+        prior = [
+            r for r in warm_start
+            if r.get('is_valid') and r['objective'] > -999.0  # Skip failed evaluations
+            and 'params_list' in r and r['params_list'] in optimizer.space
+        ]
+        if prior:
+            optimizer.tell([r['params_list'] for r in prior],
+                           [-r['objective'] for r in prior])
+            n_prior = len(prior)
+            for r in prior:
+                result_cache[cache_key(r['params_list'], r.get('n_students'))] = -r['objective']
+        print(f"[WARM START] Reused {n_prior} of {len(warm_start)} prior evaluations")
+        print()
+
+    refine_start = max(0, n_iter - gp_refine) if gp_schedule is None else n_iter
 
     # Track results
     all_results = []
+    valid_objectives = []  # Kept incrementally for the convergence plot
     best_objective = -999.0
     best_config = None
     best_metrics = None
     no_improvement_count = 0
 
-    # Optimization loop
-    for i in range(n_iter):
-        iteration_start = time.time()
-
-        print(f"[Iteration {i+1}/{n_iter}]")
-
-        # Get next configuration to try
-        suggested_params = optimizer.ask()
-
-        # Evaluate
-        neg_objective = evaluate_with_objective(suggested_params)
-
-        # Update optimizer
-        optimizer.tell(suggested_params, neg_objective)
-
-        # Track results
-        objective = -neg_objective
-        all_results.append({
-            'iteration': i + 1,
-            'params': {
-                'initial_weight': suggested_params[0],
-                'phase1_end': int(suggested_params[1]),
-                'phase2_end': int(suggested_params[2]),
-                'phase1_target': suggested_params[3],
-                'phase2_target': suggested_params[4],
-                'max_weight': suggested_params[5]
-            },
-            'objective': objective,
-            'is_valid': validate_config(suggested_params)
-        })
-
-        # Check if new best
-        if objective > best_objective:
-            best_objective = objective
-            best_config = suggested_params
-            best_metrics = all_results[-1]
-            no_improvement_count = 0
-            print(f"  [*] NEW BEST! Objective={objective:.4f}")
-        else:
-            no_improvement_count += 1
-
-        iteration_time = time.time() - iteration_start
-        print(f"  Iteration time: {iteration_time:.1f}s")
+    # A warm-started run has to beat the prior run's full-fidelity best
+    prior_full = [r for r in prior
+                  if r.get('n_students', FULL_FIDELITY_STUDENTS) == FULL_FIDELITY_STUDENTS]
+    if prior_full:
+        best_metrics = max(prior_full, key=lambda r: r['objective'])
+        best_objective = best_metrics['objective']
+        best_config = best_metrics['params']
+        print(f"[WARM START] Prior best: Objective={best_objective:.4f}")
         print()
 
-        # Early stopping
-        if no_improvement_count >= EARLY_STOP_PATIENCE:
-            print(f"[STOP] Early stopping: No improvement for {EARLY_STOP_PATIENCE} iterations")
-            break
-
-        # Save checkpoint every 10 iterations
-        if (i + 1) % 10 == 0:
-            save_results(all_results, best_config, best_metrics, optimizer)
+    # Optimization loop: keep n_workers evaluations in flight at all times
+    with open(checkpoint_file, 'ab') as checkpoint, \
+            ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+        ready = []  # (params, n_students, neg_objective) awaiting tell
+        n_submitted = 0
+        stop = False
+
+        while True:
+            # Refill the pool
+            while not stop and n_submitted < n_iter and len(pending) < n_workers:
+                if n_submitted == refine_start:
+                    # Hand all observations over to a GP for the final stretch
+                    print(f"[GP] Switching to GP surrogate for the last {n_iter - refine_start} iterations")
+                    previous = optimizer
+                    optimizer, gp_schedule = make_optimizer('GP', n_initial)
+                    if previous.Xi:
+                        optimizer.tell(previous.Xi, previous.yi)
+
+                suggested_params = ask_with_liars(
+                    optimizer,
+                    [p for p, _, _ in pending.values()] + [p for p, _, _, _ in ready]
+                )
+                n_students = students_for_iteration(n_prior + n_submitted, n_initial)
+                n_submitted += 1
+
+                key = cache_key(suggested_params, n_students)
+                if key in result_cache:
+                    print(f"[CACHE] Reusing result for duplicate config {key[:-1]}")
+                    ready.append((suggested_params, n_students, result_cache[key], None))
+                    continue
+
+                future = executor.submit(evaluate_with_objective, suggested_params, n_students)
+                pending[future] = (suggested_params, n_students, time.time())
+
+            if not pending and not ready:
+                break
+
+            # Don't block on running evaluations while cached results are waiting
+            done, _ = wait(pending, timeout=0 if ready else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                suggested_params, n_students, submitted = pending.pop(future)
+                ready.append((suggested_params, n_students, future.result(),
+                              time.time() - submitted))
+
+            # Check if the batch holds a new best (one scan, one update).
+            # Lower-fidelity objectives are noisier and not comparable, so
+            # only full-fidelity evaluations can become the incumbent or
+            # count toward early stopping
+            full = np.array([n == FULL_FIDELITY_STUDENTS for _, n, _, _ in ready])
+            batch_objectives = np.where(full, -np.asarray([neg for _, _, neg, _ in ready]), -np.inf)
+            best_idx = int(np.argmax(batch_objectives))
+            improved = batch_objectives[best_idx] > best_objective
+
+            for j, (suggested_params, n_students, neg_objective, elapsed) in enumerate(ready):
+                if neg_objective != 999.0:  # Failed evaluations are worth retrying
+                    result_cache[cache_key(suggested_params, n_students)] = neg_objective
+
+                # Update optimizer
+                if gp_schedule is not None:
+                    gp_schedule.before_tell()
+                optimizer.tell(suggested_params, neg_objective)
+
+                i = len(all_results) + 1
+                print(f"[Iteration {i}/{n_iter}]")
+
+                # Track results
+                objective = -neg_objective
+                config = decode_params(suggested_params)
+                is_valid = validate_config(config)
+                all_results.append({
+                    'iteration': i,
+                    'params': config,
+                    'params_list': params_to_list(suggested_params),
+                    'objective': objective,
+                    'n_students': n_students,
+                    'is_valid': is_valid
+                })
+                if is_valid:
+                    valid_objectives.append(objective)
+                checkpoint.write(orjson.dumps(
+                    all_results[-1],
+                    option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_SERIALIZE_NUMPY
+                ))
+                checkpoint.flush()
+
+                # Log the completed evaluation under its own header; workers
+                # finish out of order, so their output is not printed there
+                print(f"  Config: initial={config['initial_weight']:.2f}, "
+                      f"p1={config['phase1_end']}, p2={config['phase2_end']}, "
+                      f"t1={config['phase1_target']:.2f}, t2={config['phase2_target']:.2f}, "
+                      f"max={config['max_weight']:.2f}, students={n_students}")
+                if neg_objective == 999.0:
+                    print("  ❌ Evaluation failed")
+                else:
+                    print(f"  [+] Objective={objective:.4f}" + ("" if is_valid else " (invalid config)"))
+                if improved and j == best_idx:
+                    print(f"  [*] NEW BEST! Objective={objective:.4f}")
+                if elapsed is None:
+                    print("  Iteration time: cached")
+                else:
+                    print(f"  Iteration time: {elapsed:.1f}s")
+                print()
+
+            if improved:
+                best_objective = float(batch_objectives[best_idx])
+                best_metrics = all_results[len(all_results) - len(ready) + best_idx]
+                best_config = best_metrics['params']
+                no_improvement_count = int(full[best_idx + 1:].sum())
+            else:
+                no_improvement_count += int(full.sum())
+            ready.clear()
+
+            # Early stopping: stop proposing, but still record in-flight results
+            if not stop and no_improvement_count >= EARLY_STOP_PATIENCE:
+                print(f"[STOP] Early stopping: No improvement for {EARLY_STOP_PATIENCE} iterations")
+                stop = True
 
     print("=" * 80)
     print("OPTIMIZATION COMPLETE!")
@@ -277,7 +575,9 @@ def run_optimization(n_iter: int = 150, n_initial: int = 25) -> dict:
         'all_results': all_results,
         'best_config': best_config,
         'best_metrics': best_metrics,
-        'optimizer': optimizer
+        'optimizer': optimizer,
+        'objectives': valid_objectives,
+        'timestamp': timestamp
     }
 
 
@@ -285,47 +585,53 @@ def run_optimization(n_iter: int = 150, n_initial: int = 25) -> dict:
 # RESULT SAVING & VISUALIZATION
 # ============================================================================
 
-def save_results(all_results: List[dict], best_config, best_metrics, optimizer):
-    """Save optimization results to JSON and plots."""
-    results_dir = Path(__file__).parent / 'results'
-    results_dir.mkdir(exist_ok=True)
+def save_results(all_results: List[dict], best_config, best_metrics, optimizer,
+                 timestamp: str = None):
+    """Save a full JSON snapshot of the optimization results."""
+    RESULTS_DIR.mkdir(exist_ok=True)
 
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    if timestamp is None:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
 
-    # Save JSON
-    output_file = results_dir / f'optimization_results_{timestamp}.json'
-    with open(output_file, 'w') as f:
-        json.dump({
+    output_file = RESULTS_DIR / f'optimization_results_{timestamp}.json'
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps({
             'timestamp': datetime.now().isoformat(),
-            'best_config': {
-                'initial_weight': best_config[0],
-                'phase1_end': int(best_config[1]),
-                'phase2_end': int(best_config[2]),
-                'phase1_target': best_config[3],
-                'phase2_target': best_config[4],
-                'max_weight': best_config[5]
-            } if best_config is not None else None,
+            'best_config': best_config,
             'best_objective': best_metrics['objective'] if best_metrics else None,
             'all_results': all_results
-        }, f, indent=2)
+        }, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
 
     print(f"  💾 Results saved to: {output_file}")
 
-    # Create convergence plot
+
+def save_convergence_plot(objectives: List[float], timestamp: str):
+    """
+    Plot objective and best-so-far curves.
+
+    Rendered once at the end of a run; matplotlib is imported here (with
+    the non-interactive Agg backend) so the optimization loop and its
+    worker processes never pay for it.
+
+    Args:
+        objectives: Valid-config objectives in iteration order
+        timestamp: Run timestamp used in the output file name
+    """
+    RESULTS_DIR.mkdir(exist_ok=True)
+
     try:
-        objectives = [r['objective'] for r in all_results if r['is_valid']]
-        iterations = list(range(1, len(objectives) + 1))
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+
+        objectives = np.asarray(objectives, dtype=np.float64)
+        iterations = np.arange(1, len(objectives) + 1)
 
         fig, ax = plt.subplots(figsize=(12, 6))
         ax.plot(iterations, objectives, 'b-', alpha=0.3, label='Objective')
 
         # Plot best so far
-        best_so_far = []
-        current_best = -999
-        for obj in objectives:
-            if obj > current_best:
-                current_best = obj
-            best_so_far.append(current_best)
+        best_so_far = np.maximum.accumulate(objectives)
 
         ax.plot(iterations, best_so_far, 'r-', linewidth=2, label='Best so far')
         ax.set_xlabel('Iteration')
@@ -334,7 +640,7 @@ def save_results(all_results: List[dict], best_config, best_metrics, optimizer):
         ax.legend()
         ax.grid(True, alpha=0.3)
 
-        plot_file = results_dir / f'convergence_{timestamp}.png'
+        plot_file = RESULTS_DIR / f'convergence_{timestamp}.png'
         plt.savefig(plot_file, dpi=300, bbox_inches='tight')
         plt.close()
 
@@ -351,19 +657,36 @@ def main():
     parser = argparse.ArgumentParser(description='Bayesian optimization for hybrid weights')
     parser.add_argument('--n-iter', type=int, default=150, help='Number of iterations')
     parser.add_argument('--n-initial', type=int, default=25, help='Random initialization points')
+    parser.add_argument('--n-workers', type=int, default=DEFAULT_N_WORKERS,
+                        help='Configurations evaluated in parallel')
+    parser.add_argument('--surrogate', choices=SURROGATES, default=DEFAULT_SURROGATE,
+                        help='Surrogate model for the main optimization loop')
+    parser.add_argument('--gp-refine', type=int, default=GP_REFINE_ITER,
+                        help='Final iterations that switch to a GP surrogate (0 to disable)')
+    parser.add_argument('--warm-start', type=Path, default=None,
+                        help='Results file (.jsonl or .json) of a previous run to start from')
     args = parser.parse_args()
 
     start_time = time.time()
 
-    results = run_optimization(n_iter=args.n_iter, n_initial=args.n_initial)
+    results = run_optimization(
+        n_iter=args.n_iter,
+        n_initial=args.n_initial,
+        n_workers=args.n_workers,
+        surrogate=args.surrogate,
+        gp_refine=args.gp_refine,
+        warm_start=load_prior_results(args.warm_start) if args.warm_start else None
+    )
 
     # Save final results
     save_results(
         results['all_results'],
         results['best_config'],
         results['best_metrics'],
-        results['optimizer']
+        results['optimizer'],
+        timestamp=results['timestamp']
     )
+    save_convergence_plot(results['objectives'], results['timestamp'])
 
     # Print summary
     elapsed = time.time() - start_time
@@ -374,16 +697,17 @@ def main():
     print()
     if results['best_config'] is not None:
         print("Best configuration found:")
-        print(f"  initial_weight: {results['best_config'][0]:.3f}")
-        print(f"  phase1_end: {int(results['best_config'][1])}")
-        print(f"  phase2_end: {int(results['best_config'][2])}")
-        print(f"  phase1_target: {results['best_config'][3]:.3f}")
-        print(f"  phase2_target: {results['best_config'][4]:.3f}")
-        print(f"  max_weight: {results['best_config'][5]:.3f}")
+        print(f"  initial_weight: {results['best_config']['initial_weight']:.3f}")
+        print(f"  phase1_end: {results['best_config']['phase1_end']}")
+        print(f"  phase2_end: {results['best_config']['phase2_end']}")
+        print(f"  phase1_target: {results['best_config']['phase1_target']:.3f}")
+        print(f"  phase2_target: {results['best_config']['phase2_target']:.3f}")
+        print(f"  max_weight: {results['best_config']['max_weight']:.3f}")
         print()
         print(f"Best objective: {results['best_metrics']['objective']:.4f}")
     else:
-        print("No valid configuration found!")
+        print("No valid full-fidelity configuration found! "
+              f"(the first {2 * args.n_initial} iterations run at reduced fidelity)")
 
     print()
     print(f"Total time: {elapsed/3600:.2f} hours")
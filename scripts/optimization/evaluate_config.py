@@ -3,14 +3,184 @@ Evaluate a hybrid weight configuration using Monte Carlo simulation.
 
 This script acts as a bridge between Python Bayesian optimization
 and the TypeScript monte-carlo simulation.
+
+When the persistent driver (scripts/testing/mc-worker.ts) is present,
+each process keeps one long-lived tsx worker and sends it one JSON
+config per line on stdin; the worker answers with one JSON simulation
+result per line on stdout (logs go to stderr). Otherwise every call
+spawns a fresh monte-carlo-contextual-bandit.ts run, which reports the
+same result object on a single `RESULT:{json}` stdout line (or writes
+it to the file named by HYBRID_RESULT_PATH); its output is streamed
+rather than buffered.
 """
 
 import subprocess
-import json
 import os
+import shutil
+import signal
 import sys
+import threading
+import time
+import uuid
+from collections import deque
 from pathlib import Path
 
+import orjson
+
+PROJECT_ROOT = Path(__file__).parent.parent.parent
+TESTING_DIR = Path(__file__).parent.parent / 'testing'
+WORKER_SCRIPT = TESTING_DIR / 'mc-worker.ts'
+
+# Resolved once so simulations run without a shell (npx is npx.cmd on Windows)
+NPX = shutil.which('npx.cmd') or shutil.which('npx') or 'npx'
+
+# Use smaller config for faster optimization: testing (100 students, 50 questions)
+MC_CONFIG = 'testing'
+MC_SCENARIO = 'Balanced'
+MC_TIMEOUT = 300  # 5 minute timeout per iteration
+
+RESULT_PREFIX = 'RESULT:'
+LOG_TAIL_LINES = 50  # Simulator output kept for error reports
+
+# npx runs the simulator as a grandchild (npm exec -> sh -> node), so each
+# simulator gets its own process group that can be killed as a whole
+if sys.platform == 'win32':
+    _SPAWN_GROUP = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    _SPAWN_GROUP = {'start_new_session': True}
+
+# Simulator environment shared by every one-shot run, built once at import;
+# each call only layers its own HYBRID_* values on top
+_BASE_ENV = {
+    **os.environ,
+    'HYBRID_OPTIMIZATION_MODE': 'true',  # Signal to use env vars
+    'HYBRID_EMIT_STDOUT': '1'  # Report results on a RESULT: line
+}
+
+
+def _failed(error: str) -> dict:
+    """Metrics returned when an evaluation could not be completed."""
+    return {
+        'correlation': 0.0,
+        'rmse': 999.0,
+        'mae': 999.0,
+        'regret': 999.0,
+        'error': error
+    }
+
+
+def _kill_tree(proc: subprocess.Popen):
+    """Kill a simulator together with every process it spawned."""
+    # Once reaped, its pid (and process group id) may belong to someone else
+    if proc.returncode is not None:
+        return
+    if sys.platform == 'win32':
+        subprocess.run(['taskkill', '/T', '/F', '/PID', str(proc.pid)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if proc.poll() is None:
+            proc.kill()
+    else:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass  # Whole group already gone
+
+
+def _extract_metrics(data: dict) -> dict:
+    """Extract hybrid mode metrics from a simulation result."""
+    hybrid_metrics = data['modes']['hybrid']
+
+    return {
+        'correlation': hybrid_metrics['correlation'],
+        'rmse': hybrid_metrics['rmse'],
+        'mae': hybrid_metrics['mae'],
+        'regret': hybrid_metrics['performance']['avgRegret']
+    }
+
+
+class MCWorker:
+    """
+    Long-lived tsx process serving simulation requests over stdin/stdout.
+
+    Pays Node.js startup and TypeScript transpilation once per process
+    instead of once per evaluation.
+    """
+
+    def __init__(self, script_path: Path = WORKER_SCRIPT):
+        self.proc = subprocess.Popen(
+            [NPX, 'tsx', str(script_path)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            bufsize=1,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            cwd=PROJECT_ROOT,
+            **_SPAWN_GROUP
+        )
+
+    def evaluate(self, params: dict, timeout: float = MC_TIMEOUT) -> dict:
+        """Send one config to the worker and wait for its result line."""
+        self.proc.stdin.write(orjson.dumps(params).decode() + '\n')
+        self.proc.stdin.flush()
+
+        # A hung simulation is killed (its whole process tree, so nothing
+        # keeps stdout open), which unblocks readline with EOF
+        deadline = time.monotonic() + timeout
+        watchdog = threading.Timer(timeout, _kill_tree, args=(self.proc,))
+        watchdog.start()
+        try:
+            line = self.proc.stdout.readline()
+        finally:
+            watchdog.cancel()
+
+        if time.monotonic() >= deadline:
+            raise RuntimeError('Timeout')
+        if not line:
+            raise RuntimeError(f"Monte-carlo worker exited (code {self.proc.poll()})")
+
+        return orjson.loads(line)
+
+    def close(self):
+        """Signal end of input and wait for the worker to exit."""
+        if self.proc.poll() is None:
+            self.proc.stdin.close()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                _kill_tree(self.proc)
+                self.proc.wait()
+
+    def kill(self):
+        """Kill the worker and its simulator processes."""
+        _kill_tree(self.proc)
+        self.proc.wait()
+
+
+_worker = None
+
+
+def _evaluate_with_worker(params: dict) -> dict:
+    """Evaluate through this process's persistent worker, restarting it on failure."""
+    global _worker
+
+    try:
+        if _worker is None:
+            _worker = MCWorker()
+        return _extract_metrics(_worker.evaluate(params))
+    except KeyboardInterrupt:
+        # The worker runs in its own session, so Ctrl+C never reaches it
+        if _worker is not None:
+            _worker.kill()
+        raise
+    except Exception as e:
+        print(f"Error evaluating config: {e}", file=sys.stderr)
+        if _worker is not None:
+            # A failed worker may be hung or half-dead; don't leave it running
+            _worker.kill()
+            _worker = None
+        return _failed(str(e))
+
 
 def evaluate_config(
     initial_weight: float,
@@ -18,7 +188,8 @@ def evaluate_config(
     phase2_end: int,
     phase1_target: float,
     phase2_target: float,
-    max_weight: float
+    max_weight: float,
+    n_students: int = None
 ) -> dict:
     """
     Evaluate a configuration by running monte-carlo simulation.
@@ -26,106 +197,122 @@ def evaluate_config(
     Args:
         initial_weight: Starting LinUCB weight (0.40-0.60)
         phase1_end: Phase 1→2 transition (5-15 questions)
-        phase2_end: Phase 2→3 transition (15-30 questions)
-        phase1_target: Weight at end of phase 1 (0.55-0.75)
-        phase2_target: Weight at end of phase 2 (0.75-0.95)
+        phase2_end: Phase 2→3 transition (9-40 questions)
+        phase1_target: Weight at end of phase 1 (0.40-0.98, between
+            initial_weight and phase2_target)
+        phase2_target: Weight at end of phase 2 (0.40-0.98, between
+            phase1_target and max_weight)
         max_weight: Maximum weight cap (0.85-0.98)
+        n_students: Simulated students (default: the MC config's own count)
 
     Returns:
         dict with keys: correlation, rmse, mae, regret
     """
 
+    if WORKER_SCRIPT.exists():
+        return _evaluate_with_worker({
+            'config': MC_CONFIG,
+            'scenario': MC_SCENARIO,
+            'initial_weight': initial_weight,
+            'phase1_end': int(phase1_end),
+            'phase2_end': int(phase2_end),
+            'phase1_target': phase1_target,
+            'phase2_target': phase2_target,
+            'max_weight': max_weight,
+            'n_students': n_students
+        })
+
+    # Caller-chosen results file (for simulators without RESULT: support),
+    # unique per call so concurrent evaluations never collide
+    result_path = TESTING_DIR / 'results' / f'mc_{uuid.uuid4().hex}.json'
+
     # Set environment variables for config injection
-    env = os.environ.copy()
-    env['HYBRID_INITIAL_WEIGHT'] = str(initial_weight)
-    env['HYBRID_PHASE1_END'] = str(int(phase1_end))
-    env['HYBRID_PHASE2_END'] = str(int(phase2_end))
-    env['HYBRID_PHASE1_TARGET'] = str(phase1_target)
-    env['HYBRID_PHASE2_TARGET'] = str(phase2_target)
-    env['HYBRID_MAX_WEIGHT'] = str(max_weight)
-    env['HYBRID_OPTIMIZATION_MODE'] = 'true'  # Signal to use env vars
+    env = _BASE_ENV | {
+        'HYBRID_INITIAL_WEIGHT': f'{initial_weight:.6g}',
+        'HYBRID_PHASE1_END': f'{int(phase1_end)}',
+        'HYBRID_PHASE2_END': f'{int(phase2_end)}',
+        'HYBRID_PHASE1_TARGET': f'{phase1_target:.6g}',
+        'HYBRID_PHASE2_TARGET': f'{phase2_target:.6g}',
+        'HYBRID_MAX_WEIGHT': f'{max_weight:.6g}',
+        'HYBRID_RESULT_PATH': str(result_path)
+    }
+    if n_students is not None:
+        env['HYBRID_N_STUDENTS'] = f'{int(n_students)}'
 
     # Path to monte-carlo script
-    script_dir = Path(__file__).parent.parent / 'testing'
-    script_path = script_dir / 'monte-carlo-contextual-bandit.ts'
+    script_path = TESTING_DIR / 'monte-carlo-contextual-bandit.ts'
 
     # Run monte-carlo simulation
-    # Use smaller config for faster optimization: testing (100 students, 50 questions)
-    cmd = ['npx', 'tsx', str(script_path), 'testing', 'Balanced']
+    cmd = [NPX, 'tsx', str(script_path), MC_CONFIG, MC_SCENARIO]
 
+    proc = None
     try:
-        result = subprocess.run(
+        # Stream output line by line: only the RESULT line is parsed and a
+        # bounded tail of the logs is kept for error reports
+        proc = subprocess.Popen(
             cmd,
             env=env,
-            capture_output=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=1,
             text=True,
             encoding='utf-8',  # Force UTF-8 encoding on Windows
             errors='replace',  # Replace invalid chars instead of crashing
-            timeout=300,  # 5 minute timeout per iteration
-            cwd=Path(__file__).parent.parent.parent,  # Project root
-            shell=True  # Required on Windows for npx to work
+            cwd=PROJECT_ROOT,
+            **_SPAWN_GROUP
         )
 
-        if result.returncode != 0:
-            print(f"Monte-carlo stderr:\n{result.stderr}", file=sys.stderr)
-            print(f"Error running monte-carlo (exit code {result.returncode})", file=sys.stderr)
-            return {
-                'correlation': 0.0,
-                'rmse': 999.0,
-                'mae': 999.0,
-                'regret': 999.0,
-                'error': result.stderr
-            }
-
-        # Find the results JSON file (most recent in results/ directory)
-        results_dir = Path(__file__).parent.parent / 'testing' / 'results'
-        json_files = list(results_dir.glob('cb-simulation-*.json'))
-
-        if not json_files:
-            print("No results file found!", file=sys.stderr)
-            return {
-                'correlation': 0.0,
-                'rmse': 999.0,
-                'mae': 999.0,
-                'regret': 999.0,
-                'error': 'No results file'
-            }
+        # Kill the whole process tree: node is a grandchild of npx and
+        # would otherwise keep stdout open past the timeout
+        deadline = time.monotonic() + MC_TIMEOUT
+        watchdog = threading.Timer(MC_TIMEOUT, _kill_tree, args=(proc,))
+        watchdog.start()
+
+        data = None
+        log_tail = deque(maxlen=LOG_TAIL_LINES)
+        try:
+            for line in proc.stdout:
+                if data is None and line.startswith(RESULT_PREFIX):
+                    data = orjson.loads(line[len(RESULT_PREFIX):])
+                else:
+                    log_tail.append(line)
+            returncode = proc.wait()
+        finally:
+            watchdog.cancel()
+
+        if time.monotonic() >= deadline:
+            print("Monte-carlo simulation timed out!", file=sys.stderr)
+            return _failed('Timeout')
 
-        # Get most recent file
-        latest_file = max(json_files, key=lambda p: p.stat().st_mtime)
+        if returncode != 0:
+            output = ''.join(log_tail)
+            print(f"Monte-carlo output:\n{output}", file=sys.stderr)
+            print(f"Error running monte-carlo (exit code {returncode})", file=sys.stderr)
+            return _failed(output)
+
+        if data is not None:
+            return _extract_metrics(data)
+
+        if not result_path.exists():
+            print("No results file found!", file=sys.stderr)
+            return _failed('No results file')
 
         # Parse results
-        with open(latest_file, 'r') as f:
-            data = json.load(f)
-
-        # Extract hybrid mode metrics
-        hybrid_metrics = data['modes']['hybrid']
-
-        return {
-            'correlation': hybrid_metrics['correlation'],
-            'rmse': hybrid_metrics['rmse'],
-            'mae': hybrid_metrics['mae'],
-            'regret': hybrid_metrics['performance']['avgRegret']
-        }
-
-    except subprocess.TimeoutExpired:
-        print("Monte-carlo simulation timed out!", file=sys.stderr)
-        return {
-            'correlation': 0.0,
-            'rmse': 999.0,
-            'mae': 999.0,
-            'regret': 999.0,
-            'error': 'Timeout'
-        }
+        with open(result_path, 'rb') as f:
+            data = orjson.loads(f.read())
+
+        return _extract_metrics(data)
+
     except Exception as e:
         print(f"Error evaluating config: {e}", file=sys.stderr)
-        return {
-            'correlation': 0.0,
-            'rmse': 999.0,
-            'mae': 999.0,
-            'regret': 999.0,
-            'error': str(e)
-        }
+        return _failed(str(e))
+    finally:
+        # Don't leave a simulator running with nobody reading its output
+        if proc is not None and proc.returncode is None:
+            _kill_tree(proc)
+            proc.wait()
+        # Per-call files are only a transport; don't let them pile up
+        result_path.unlink(missing_ok=True)
 
 
 if __name__ == '__main__':
@@ -139,4 +326,4 @@ if __name__ == '__main__':
         phase2_target=0.85,
         max_weight=0.90
     )
-    print(json.dumps(results, indent=2))
+    print(orjson.dumps(results, option=orjson.OPT_INDENT_2).decode())